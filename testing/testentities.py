@@ -1,13 +1,62 @@
 import logging
-from vc3infoservice.core import InfoEntity
+from vc3infoservice.core import InfoEntity, generateinit
 
+# NOTE: if this entity hierarchy is ever compiled with Cython, move the
+# attribute initialization into __cinit__ on a cdef class with typed
+# attributes; the generated __init__ below would then only handle the
+# Python-level debug logging. Not done here because the project ships
+# pure Python with no C extension build step in setup.py.
+
+log = logging.getLogger(__name__)
+
+# Shared empty sentinel for allocation-free "no allocations yet" state.
+_EMPTY = ()
+
+def _lazyattribute(attrname):
+    '''
+    Property for rarely-set optional infoattributes. Values live in a
+    single _opt dict that is only allocated on first real assignment, so
+    instances that never set the attribute pay no per-field cost.
+    Setting None on an instance with no _opt dict is a no-op.
+    '''
+    def fget(self):
+        try:
+            opt = object.__getattribute__(self, '_opt')
+        except AttributeError:
+            return None
+        return opt.get(attrname)
+
+    def fset(self, value):
+        try:
+            opt = object.__getattribute__(self, '_opt')
+        except AttributeError:
+            if value is None:
+                return
+            opt = {}
+            object.__setattr__(self, '_opt', opt)
+        opt[attrname] = value
+
+    return property(fget, fset)
+
+@generateinit
 class User(InfoEntity):
     '''
     Represents a VC3 instance user account.
-    As policy, name, email, and organization must be set.  
-    
+    As policy, name, email, and organization must be set.
+
+    __init__ is generated from infoattributes by generateinit.
+
+    :param str name: The unique VC3 username of this user
+    :param str first: User's first name
+    :param str last: User's last name
+    :param str email: User's email address
+    :param str organization: User's institutional affiliation or employer
+    :param str description: Long-form description
+    :param str displayname: Pretty human-readable name/short description
+    :param str url: High-level URL reference for this entity.
+    :param str docurl: Link to how-to/usage documentation for this entity.
     '''
-    infoattributes = ['name',
+    infoattributes = ('name',
                      'state',
                      'acl',
                      'first',
@@ -19,62 +68,49 @@ class User(InfoEntity):
                      'displayname',
                      'url',
                      'docurl',
-                     'allocations',                  
-                     ] 
+                     'allocations',
+                     )
     infokey = 'user'
     validvalues = {}
-    intattributes = []
-    nameattributes = ['first','last']
-    
-    def __init__(self,
-                   name,
-                   state,
-                   acl,
-                   first,
-                   last,
-                   email,
-                   organization,
-                   identity_id=None,
-                   description=None,
-                   displayname=None,
-                   url=None,
-                   docurl=None,
-                   allocations = None
-                ):
+    intattributes = ()
+    nameattributes = ('first','last')
+    internattributes = ('state','organization')
+    requiredattributes = ('name',
+                          'state',
+                          'acl',
+                          'first',
+                          'last',
+                          'email',
+                          'organization',
+                          )
+
+    # Fixed attribute set, so avoid the per-instance __dict__.
+    # _diffmap and storenew are bookkeeping attributes set by InfoEntity methods.
+    __slots__ = ('state',
+                 'acl',
+                 'name',
+                 'first',
+                 'last',
+                 'email',
+                 'organization',
+                 'allocations',
+                 '_opt',
+                 '_diffmap',
+                 'storenew',
+                 )
+
+    def addAllocation(self, allocation):
         '''
-        Defines a new User object. 
-              
-        :param str name: The unique VC3 username of this user
-        :param str first: User's first name
-        :param str last: User's last name
-        :param str email: User's email address
-        :param str organization: User's institutional affiliation or employer
-        :param str description: Long-form description
-        :param str displayname: Pretty human-readable name/short description
-        :param str url: High-level URL reference for this entity. 
-        :param str docurl: Link to how-to/usage documentation for this entity.          
-        :return: User:  A valid User object      
-        :rtype: User
-        
+        Append an allocation to this user, materializing the backing list
+        only on first use. Most users never gain an allocation, so the
+        default None/_EMPTY state costs no list object per instance.
         '''
-        self.log = logging.getLogger()
-        self.state = state
-        self.acl = acl
-        self.name = name
-        self.first = first
-        self.last = last
-        self.email = email
-        self.organization = organization
-        self.identity_id = identity_id
-        self.allocations = []
-        self.description = description
-        self.displayname = displayname
-        self.url = url
-        self.docurl = docurl
-        self.allocations = allocations
-        self.log.debug("Entity created: %s" % self)
+        if self.allocations is None or self.allocations is _EMPTY:
+            self.allocations = [allocation]
+        else:
+            self.allocations.append(allocation)
 
-        
-        
-        
-        
\ No newline at end of file
+# Optional attributes are read by few code paths (rendering, doc links);
+# back them with the lazily-allocated _opt dict instead of slots.
+for _attrname in ('identity_id', 'description', 'displayname', 'url', 'docurl'):
+    setattr(User, _attrname, _lazyattribute(_attrname))
@@ -12,6 +12,7 @@ __status__ = "Production"
 import logging
 import random
 import string
+import threading
 
 class InfoConnectionFailure(Exception):
     '''
@@ -72,7 +73,7 @@ class InfoAttributeFacade(object):
         log = logging.getLogger()  
         object.__setattr__(self, '_parent', parent)
         object.__setattr__(self, '_attrname', attrname)
-        log.debug("Facade made for attribute %s parent %s" % (attrname, parent))
+        log.debug("Facade made for attribute %s parent %s", attrname, parent)
 
     def __setattr__(self, name, value):
         '''
@@ -87,9 +88,9 @@ class InfoAttributeFacade(object):
                     diffmap[at] = 0
                 object.__setattr__(self,'_diffmap', diffmap)
             diffmap[name] += 1
-            log.debug('infoattribute %s incremented to %s' % ( name, diffmap[name] ) )            
+            log.debug('infoattribute %s incremented to %s', name, diffmap[name])            
         else:
-            log.debug('non-infoattribute %s' % name)
+            log.debug('non-infoattribute %s', name)
         object.__setattr__(self, name, value)
 
     def __getattr__(self, attrname):
@@ -105,10 +106,16 @@ class InfoEntity(object):
 
     '''
     infokey = 'unset'
-    infoattributes = []
-    intattributes = []
+    infoattributes = ()
+    intattributes = ()
     validvalues = {}
-    nameattributes = ['name']
+    nameattributes = ('name',)
+    # Empty slots so subclasses that declare __slots__ actually drop the
+    # per-instance __dict__. Subclasses without __slots__ are unaffected.
+    __slots__ = ()
+    # Shared logger so slotted subclasses need not store one per instance.
+    # Subclasses with a __dict__ may still shadow this with self.log.
+    log = logging.getLogger()
 
     def __setattr__(self, name, value):
         '''
@@ -126,7 +133,7 @@ class InfoEntity(object):
                 object.__setattr__(self,'_diffmap', diffmap)
             diffmap[name] += 1
         else:
-            log.debug('non-infoattribute %s' % name)
+            log.debug('non-infoattribute %s', name)
         object.__setattr__(self, name, value)
 
     #def __getattr__(self, name):
@@ -146,7 +153,7 @@ class InfoEntity(object):
     #        diffmap[name] += 1
     #        log.debug('infoattribute %s' % name)            
     #    else:
-    #        log.debug('non-infoattribute %s' % name)
+    #        log.debug('non-infoattribute %s', name)
     #    object.__getattr__(self, name)
 
 
@@ -197,11 +204,11 @@ class InfoEntity(object):
             self.log.debug("newonly not set, doing all values...")
             for attrname in self.infoattributes:
                 d[self.name][attrname] = getattr(self, attrname)
-        self.log.debug("Returning dict: %s" % d)
+        self.log.debug("Returning dict: %s", d)
         return d    
 
     def setState(self, newstate):
-        self.log.debug("%s object name=%s %s ->%s" % (self.__class__.__name__, self.name, self.state, newstate) )
+        self.log.debug("%s object name=%s %s ->%s", self.__class__.__name__, self.name, self.state, newstate)
         self.state = newstate
     
 
@@ -215,18 +222,18 @@ class InfoEntity(object):
             validlist = validvalues[keyattr]
             attrval = getattr(self, keyattr) 
             if attrval not in validlist:
-                self.log.warning("%s entity has invalid value '%s' for attribute '%s' " % (self.__class__.__name__,
-                                                                                           attrval,                                                                                            keyattr) )
+                self.log.warning("%s entity has invalid value '%s' for attribute '%s' ",
+                                 self.__class__.__name__, attrval, keyattr)
         #resources = infoclient.getdocumentobject(key=keystr)
         if hasattr(self, 'storenew'):
             entdict = self.makeDictObject(newonly=False)
-            self.log.debug("Dict obj: %s" % entdict)
+            self.log.debug("Dict obj: %s", entdict)
             infoclient._storeentitydict(keystr, entdict )
         else:
             entdict = self.makeDictObject(newonly=True)
-            self.log.debug("Dict obj: %s" % entdict)
+            self.log.debug("Dict obj: %s", entdict)
             infoclient._mergeentitydict(keystr, entdict )
-        self.log.debug("Stored entity %s in key %s" % (self.name, keystr))
+        self.log.debug("Stored entity %s in key %s", self.name, keystr)
 
     def addAcl(self, aclstring):
         pass    
@@ -238,17 +245,17 @@ class InfoEntity(object):
         '''
         Make new identical object with new name attribute. 
         '''
-        self.log.debug("making clone of %s object name=%s " % (self.__class__.__name__, self.name) )
+        self.log.debug("making clone of %s object name=%s ", self.__class__.__name__, self.name)
         dictobject = self.makeDictObject()  # has name as index of attribute dict
         dict = dictobject[self.name]
         if newname is not None:
             dict['name'] = newname
         else:
             dict['name'] = self.generateName()
-        self.log.debug('new dict is %s' % dict)    
+        self.log.debug('new dict is %s', dict)    
         newobj = self.__class__.objectFromDict(dict)
         newobj.storenew = True
-        self.log.debug('new object is %s' % newobj)
+        self.log.debug('new object is %s', newobj)
         return newobj
     
     
@@ -259,10 +266,10 @@ class InfoEntity(object):
         '''
         self.log.debug("Generating name...")
         randomstr = InfoEntity.randomChars(length)
-        self.log.debug("Got random part %s" % randomstr)
+        self.log.debug("Got random part %s", randomstr)
         newname = ""
         for na in self.__class__.nameattributes:
-            self.log.debug("Building name with %s " % na)
+            self.log.debug("Building name with %s ", na)
             newname += InfoEntity.normalizeAttribute(getattr(self, na))
         newname += "-%s" % randomstr
         return newname
@@ -290,13 +297,13 @@ class InfoEntity(object):
                 args[key] = d[key]
             except KeyError, e:
                 args[key] = None
-                log.warning("Document object does not have a '%s' key" % e.args[0])
+                log.warning("Document object does not have a '%s' key", e.args[0])
         for key in cls.intattributes:
             try:
                 if args[key] is not None:
                     args[key] = int(args[key])
             except KeyError, e:
-                log.warning("Document object does not have a '%s' key" % e.args[0])
+                log.warning("Document object does not have a '%s' key", e.args[0])
         eo = cls(**args)
         log.debug("Successfully made object from dictionary, returning...")
         return eo
@@ -311,17 +318,101 @@ class InfoEntity(object):
     @classmethod
     def normalizeAttribute(cls, value):
         log = logging.getLogger()
-        log.debug("Normalizing %s " % value)
+        log.debug("Normalizing %s ", value)
         v = str(value)
         v = v.lower()
         v = v.replace(" ","")
         v= v[0:16]
-        log.debug("Value normalized to %s" % v)
+        log.debug("Value normalized to %s", v)
         return v
       
 
+def _intern(value):
+    '''
+    Best-effort string interning for small-cardinality attribute values.
+    Unicode and non-string values pass through unchanged.
+    '''
+    try:
+        return intern(value)
+    except TypeError:
+        return value
+
+
+def _trunc(value):
+    '''
+    Shorten long string values for entity __repr__ output, matching
+    InfoEntity.__repr__ behavior.
+    '''
+    if isinstance(value, basestring) and len(value) > 80:
+        return "%s..." % value[:25]
+    return value
+
+
+def generateinit(cls):
+    '''
+    Class decorator for InfoEntity subclasses. Compiles a specialized
+    __init__ and __repr__ from the class's infoattributes declaration --
+    the same technique the stdlib dataclasses/attrs libraries use -- so
+    construction is one straight-line function instead of hand-maintained
+    boilerplate that duplicates the schema, and __repr__ avoids the
+    per-attribute getattr loop of the generic InfoEntity version.
+
+    Attributes listed in cls.requiredattributes become required positional
+    parameters (in infoattributes order); all others default to None.
+    Attributes listed in cls.internattributes are drawn from small closed
+    sets (states, organizations) and get interned so N entities with the
+    same value share one string object.
+    '''
+    log = logging.getLogger(cls.__module__)
+    required = getattr(cls, 'requiredattributes', ())
+    interned = getattr(cls, 'internattributes', ())
+    params = [a for a in cls.infoattributes if a in required]
+    params += ["%s=None" % a for a in cls.infoattributes if a not in required]
+    lines = ["def __init__(self, %s):" % ", ".join(params)]
+    for a in cls.infoattributes:
+        if a in interned:
+            lines.append("    self.%s = _intern(%s) if %s is not None else None" % (a, a, a))
+        else:
+            lines.append("    self.%s = %s" % (a, a))
+    lines.append("    if _debug_enabled(_DEBUG):")
+    lines.append("        _debug('Entity created: %s', self)")
+    reprfmt = "%s( %s )" % (cls.__name__,
+                            " ".join("%s=%%s" % a for a in cls.infoattributes))
+    reprargs = ", ".join("_trunc(self.%s)" % a for a in cls.infoattributes)
+    lines.append("def __repr__(self):")
+    lines.append("    return %r %% (%s,)" % (reprfmt, reprargs))
+    # Pre-bound logger methods: the constructor does LOAD_GLOBAL+CALL
+    # instead of attribute lookups on the logger for every instance.
+    namespace = {'_debug'         : log.debug,
+                 '_debug_enabled' : log.isEnabledFor,
+                 '_DEBUG'         : logging.DEBUG,
+                 '_intern'        : _intern,
+                 '_trunc'         : _trunc }
+    exec("\n".join(lines), namespace)
+    init = namespace['__init__']
+    init.__doc__ = "Defines a new %s object from infoattributes: %s" % (cls.__name__,
+                                                                        ', '.join(cls.infoattributes))
+    cls.__init__ = init
+    cls.__repr__ = namespace['__repr__']
+    return cls
+
+
 class InfoPersistencePlugin(object):
 
+    # Capability flag: plugins whose backend can update a single entity
+    # in place set this True and provide patch_entity(key, entityname,
+    # entitydict) and delete_entity(key, entityname). When False the
+    # handler falls back to whole-document getdocument/storedocument.
+    supports_patch = False
+
+    # Capability flag: True only if a store for one key never touches
+    # state shared with other keys, so writers of different keys may run
+    # concurrently. Backends that rewrite shared state on every store
+    # (e.g. DiskDump serializes its whole document map to one file) must
+    # leave this False; the handler then serializes all writes under a
+    # single shared lock.
+    supports_keyed_writes = False
+
     def __init__(self, parent, config, section ):
         self.log = logging.getLogger()
         self.lock = MockLock()
@@ -329,6 +420,58 @@ class InfoPersistencePlugin(object):
         self.config = config
         self.section = section
 
+class ReadWriteLock(object):
+    '''
+    Writer-preferring readers-writer lock. Any number of readers may hold
+    the lock concurrently; writers get exclusive access and are not
+    starved by a steady stream of readers.
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writerswaiting = 0
+        self._writing = False
+
+    def acquireRead(self):
+        self._cond.acquire()
+        try:
+            while self._writing or self._writerswaiting:
+                self._cond.wait()
+            self._readers += 1
+        finally:
+            self._cond.release()
+
+    def releaseRead(self):
+        self._cond.acquire()
+        try:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def acquireWrite(self):
+        self._cond.acquire()
+        try:
+            self._writerswaiting += 1
+            try:
+                while self._writing or self._readers > 0:
+                    self._cond.wait()
+            finally:
+                self._writerswaiting -= 1
+            self._writing = True
+        finally:
+            self._cond.release()
+
+    def releaseWrite(self):
+        self._cond.acquire()
+        try:
+            self._writing = False
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+
 class MockLock(object):
     '''
     Provided as a convenience for persistence back ends that don't require atomic operations. 
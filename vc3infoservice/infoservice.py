@@ -10,24 +10,31 @@ __status__ = "Production"
 
 
 import cherrypy
+import io
 import logging
 import logging.handlers
+import multiprocessing
 import os
 import platform
 import pwd
-import random
-import json
-import string
 import socket
 import sys
 import threading
 import time
 import traceback
+import weakref
+
+# Every request decodes and/or encodes JSON, so prefer the C-accelerated
+# ujson codec when available. (orjson is faster still but Python 3 only.)
+try:
+    import ujson as json
+except ImportError:
+    import json
 
 from optparse import OptionParser
 from ConfigParser import ConfigParser
 
-from vc3infoservice.core  import InfoEntityExistsException, InfoEntityMissingException
+from vc3infoservice.core  import InfoEntityExistsException, InfoEntityMissingException, ReadWriteLock
 
 # Since script is in package "vc3" we can know what to add to path for 
 # running directly during development
@@ -36,6 +43,153 @@ sys.path.append(libpath)
 
 import pluginmanager as pm
 
+log = logging.getLogger(__name__)
+
+# Hostname can only change across a restart, so look it up once.
+_HOSTNAME = socket.gethostname()
+
+# Resolved persistence plugins, keyed by (pluginname, section), so repeated
+# handler construction does not re-scan the plugin directories.
+_PLUGIN_CACHE = {}
+
+def _getpersistplugin(parent, pluginname, config, section):
+    '''
+    Resolve and instantiate the persistence plugin, memoized per
+    (pluginname, section).
+    '''
+    try:
+        return _PLUGIN_CACHE[(pluginname, section)]
+    except KeyError:
+        plugin = pm.getplugin(parent=parent,
+                              paths=['vc3infoservice', 'plugins', 'persist'],
+                              name=pluginname,
+                              config=config,
+                              section=section)
+        _PLUGIN_CACHE[(pluginname, section)] = plugin
+        return plugin
+
+
+def _snapshot(config):
+    '''
+    Walk a ConfigParser once and freeze it into a plain dict of dicts,
+    so later reads are O(1) hash lookups instead of re-running the
+    parser's defaulting/interpolation machinery.
+    '''
+    cfg = {}
+    for section in config.sections():
+        cfg[section] = dict(config.items(section))
+    return cfg
+
+
+def entitymerge(src, dest):
+    ''' 
+    Merges bare src entity into dest entity, unconditionally replacing *attribute* 
+    values at entity-attribute level. Intended to be used in-place, so dest is not returned. 
+
+    { u'allocations': [u'lincolnb.uchicago-midway']}
+     + 
+    { u'allocations': [], 
+      u'name': u'SPT', 
+      u'blueprints': []  }
+     =
+     {u'allocations': [u'lincolnb.uchicago-midway'],
+     u'name': u'SPT', 
+     u'blueprints': []}
+
+    '''
+    log.debug("Handling merging %s into %s ", src, dest)
+    for attributename in src.keys():
+        dest[attributename] = src[attributename]
+
+
+def merge(src, dest):
+    ''' 
+    Merges python primitive object src into dest and returns merged result.
+    Lists are appended.
+    Dictionaries are merged. 
+    Primitive values are overwritten. 
+    NOTE: tuples and arbitrary objects are not handled as it is totally ambiguous what should happen
+    https://stackoverflow.com/questions/7204805/dictionaries-of-dictionaries-merge/15836901
+
+    Implemented as an iterative worklist rather than recursion, with a
+    set-based union for list merges when items are hashable, so deep
+    documents cost no Python call stack and list merges are not O(n^2).
+    Module-level (rather than a method) so the write path pays no
+    bound-method dispatch, and so a compiled implementation could replace
+    it wholesale.
+    '''
+    log.debug("Handling merging %s into %s ", src, dest)
+    result = dest
+    stack = [(src, dest, None, None)]
+    while stack:
+        src, dest, parent, parentkey = stack.pop()
+        key = None
+        try:
+            if dest is None or isinstance(dest, (str, unicode, int, long, float)):
+                # border case for first run or if dest is a primitive
+                merged = src
+            elif isinstance(dest, list):
+                # lists can be only appended
+                if isinstance(src, list):
+                    try:
+                        seen = set(dest)
+                        for item in src:
+                            if item not in seen:
+                                dest.append(item)
+                                seen.add(item)
+                    except TypeError:
+                        # unhashable item somewhere; fall back to
+                        # linear membership scans
+                        for item in src:
+                            if item not in dest:
+                                dest.append(item)
+                else:
+                    log.error("Refusing to add non-list %s to list %s", src, dest)
+                merged = dest
+            elif isinstance(dest, dict):
+                # dicts must be merged
+                if isinstance(src, dict):
+                    for key in src:
+                        if key in dest:
+                            stack.append((src[key], dest[key], dest, key))
+                        else:
+                            dest[key] = src[key]
+                    merged = dest
+                elif src is None:
+                    merged = None
+                else:
+                    log.warning("Cannot merge non-dict %s into dict %s", src, dest)
+                    merged = dest
+            else:
+                raise Exception('NOT IMPLEMENTED "%s" into "%s"' % (src, dest))
+        except TypeError, e:
+            raise Exception('TypeError "%s" in key "%s" when merging "%s" into "%s"' % (e, key, src, dest))
+        if parent is None:
+            result = merged
+        elif merged is not dest:
+            parent[parentkey] = merged
+    return result
+
+
+# Upper bound on how long a mergeentity call waits for the flusher to
+# commit its batch before answering 503; generous, since a healthy flush
+# is a single fetch-merge-store round trip.
+_FLUSH_TIMEOUT = 60.0
+
+
+class _PendingMerge(object):
+    '''
+    One queued mergeentity operation awaiting the coalescing flusher.
+    '''
+    def __init__(self, entityname, entitydict):
+        self.entityname = entityname
+        self.entitydict = entitydict
+        self.done = threading.Event()
+        self.error = None         # failure message text, None on success
+        self.error_status = 500   # HTTP status when error is set; 405
+                                  # only for the non-existent-entity case
+
+
 class InfoHandler(object):
     '''
     Handles low-level operations and persistence of information 
@@ -52,21 +206,92 @@ class InfoHandler(object):
      
     '''
     def __init__(self, config):
-        self.log = logging.getLogger()
+        self.log = log
         self.log.debug("Initializing Info Handler...")
         self.config = config
-        
+        self.cfg = _snapshot(config)
+
         # Get persistence plugin
-        pluginname = config.get('persistence','plugin')
+        pluginname = self.cfg['persistence']['plugin']
         psect = "plugin-%s" % pluginname.lower()
         self.log.debug("Creating persistence plugin...")
-        self.persist = pm.getplugin(parent=self, 
-                                    paths=['vc3infoservice', 'plugins', 'persist'], 
-                                    name=pluginname, 
-                                    config=self.config, 
-                                    section=psect)
+        self.persist = _getpersistplugin(self, pluginname, self.config, psect)
+        # Per-key readers-writer locks, so readers and writers of
+        # unrelated keys no longer serialize on one global mutex. Weak
+        # values: a lock entry lives only while some request holds a
+        # reference to it, so probes of arbitrary client-supplied key
+        # strings cannot grow this map without bound.
+        # Backends whose stores rewrite state shared across keys (such
+        # as DiskDump's whole-map dump) get one shared lock instead:
+        # readers still run concurrently, but writes serialize so no
+        # dump can snapshot another key's half-applied merge or win the
+        # rename race against an already-acknowledged store.
+        self._locks = weakref.WeakValueDictionary()
+        self._lockmutex = threading.Lock()
+        if self.persist.supports_keyed_writes:
+            self._sharedlock = None
+        else:
+            self._sharedlock = ReadWriteLock()
+        # Monotonic per-key document versions, bumped on every write.
+        # Grows only with keys actually written, never with read probes.
+        self._versions = {}
+        # The counters restart at 0 while backends like DiskDump persist
+        # documents across restarts, so a "key/N" tag from a previous
+        # process could name different content. A per-process nonce in
+        # every ETag makes tags from older processes never match.
+        self.etagepoch = os.urandom(4).encode('hex')
+        # Serialized-JSON caches, invalidated by version. _json_cache
+        # holds (version, jsonstring) per key; _entity_cache holds one
+        # (version, {entityname : jsonstring}) generation per key, so a
+        # write discards every entity serialized under the old version —
+        # deleted or renamed entities cannot accumulate.
+        self._json_cache = {}
+        self._entity_cache = {}
+        # Pairing-code sidecar index per key, (version, {code : entryname});
+        # rebuilt lazily when the pairing document changes.
+        self._paircodeindex = {}
+        # Write coalescing: near-simultaneous mergeentity calls on the
+        # same key are drained by a background flusher into a single
+        # fetch-merge-store round trip against the backend.
+        self._pending = {}
+        self._pendingcond = threading.Condition(threading.Lock())
+        self._flusher = threading.Thread(target=self._flushloop)
+        self._flusher.setDaemon(True)
+        self._flusher.start()
         self.log.debug("Done initializing InfoHandler")
 
+    def _lockfor(self, key):
+        '''
+        Return the ReadWriteLock guarding <key>, creating it on first
+        use. Backends without per-key write isolation share one lock.
+        '''
+        if self._sharedlock is not None:
+            return self._sharedlock
+        self._lockmutex.acquire()
+        try:
+            try:
+                return self._locks[key]
+            except KeyError:
+                rwlock = self._locks[key] = ReadWriteLock()
+                return rwlock
+        finally:
+            self._lockmutex.release()
+
+    def _bumpversion(self, key):
+        '''
+        Advance the document version for <key>. Caller must hold the
+        per-key write lock.
+        '''
+        v = self._versions.get(key, 0) + 1
+        self._versions[key] = v
+        return v
+
+    def getversion(self, key):
+        '''
+        Current document version for <key>; 0 if never written.
+        '''
+        return self._versions.get(key, 0)
+
 ################################################################################
 #                     Entity-oriented methods
 ################################################################################
@@ -83,9 +308,10 @@ class InfoHandler(object):
                        }
                    }
         '''
-        self.log.debug("input JSON doc to merge is %s" % edoc)
+        self.log.debug("input JSON doc to merge is %s", edoc)
         entitydict = json.loads(edoc)
-        self.persist.lock.acquire()
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
         try:
             currentdoc = self.persist.getdocument(key)
             try:
@@ -93,62 +319,123 @@ class InfoHandler(object):
                 cherrypy.response.status = 405
                 return "Attempt to create (POST) already-existing Entity. Name: %s. " % entityname
             except KeyError:
-                self.log.debug("No existing entity %s. As expected..." % entityname)
+                self.log.debug("No existing entity %s. As expected...", entityname)
                 pass
             
-            self.log.debug("Merging entity with existing document.")
-            newdoc = self.merge( entitydict, currentdoc)
-            self.persist.storedocument(key, newdoc)
-            self.log.debug("Successfully stored entity.")            
+            if self.persist.supports_patch and entityname in entitydict and len(entitydict) == 1:
+                # Backend can write the one new entity directly; skip
+                # rewriting the whole document. Only taken when the
+                # posted doc holds exactly the named entity — anything
+                # else (sibling keys, mismatched key) goes through the
+                # merge path, which stores the whole document as before
+                # on every backend.
+                self.persist.patch_entity(key, entityname, entitydict[entityname])
+            else:
+                newdoc = self.merge( entitydict, currentdoc)
+                self.persist.storedocument(key, newdoc)
+            self._bumpversion(key)
         finally:
-            self.persist.lock.release()        
+            rwlock.releaseWrite()
+        self.log.debug("Successfully stored entity.")
 
     def mergeentity(self, key, entityname, edoc):
         '''
-        merges contents of (update-only) JSON doc string by entity level. 
+        merges contents of (update-only) JSON doc string by entity level.
         Within entity, uses merge that replaces attributes with new values.
+        The parsed update is queued for the coalescing flusher; this call
+        blocks until the batch containing it has been committed.
         '''
-        self.log.debug("input entity doc to merge is %s" % edoc)       
+        self.log.debug("input entity doc to merge is %s", edoc)
         # e.g. {"SPT": {"allocations": ["lincolnb.uchicago-midway"]}}
-        self.log.debug("input JSON doc to merge is type %s" % type(edoc))
+        self.log.debug("input JSON doc to merge is type %s", type(edoc))
         entitydict = json.loads(edoc)
-        self.persist.lock.acquire()
+        op = _PendingMerge(entityname, entitydict)
+        self._pendingcond.acquire()
         try:
-            currentdoc = self.persist.getdocument(key)
-            existingentity = currentdoc[entityname]
-            newentity = entitydict[entityname]
-            #self.log.debug("Existing entity: %s" % existingentity)
-            #self.log.debug("New entity:" % newentity)
-            #self.log.debug("Merging newentity with existing entity.")
-            self.entitymerge(newentity, existingentity)
-            #self.log.debug("Resulting existing: %s" % existingentity)
-            self.persist.storedocument(key, currentdoc)
-            self.log.debug("Successfully stored entity.")            
-        except KeyError:
-            cherrypy.response.status = 405
-            return "Attempt to update (PUT) non-existent Entity. Name: %s. " % entityname
+            self._pending.setdefault(key, []).append(op)
+            self._pendingcond.notify()
+        finally:
+            self._pendingcond.release()
+        if not op.done.wait(_FLUSH_TIMEOUT):
+            self.log.error("Merge for key %s entity %s not committed within %ss", key, entityname, _FLUSH_TIMEOUT)
+            cherrypy.response.status = 503
+            return "Merge not committed within %s seconds. Name: %s. " % (_FLUSH_TIMEOUT, entityname)
+        if op.error is not None:
+            cherrypy.response.status = op.error_status
+            return op.error
+        self.log.debug("Successfully stored entity.")
+
+    def _flushloop(self):
+        '''
+        Background write-coalescer. Sleeps until mergeentity queues work,
+        then drains everything pending so each key gets one
+        fetch-merge-store cycle regardless of how many updates arrived.
+        '''
+        while True:
+            self._pendingcond.acquire()
+            try:
+                while not self._pending:
+                    self._pendingcond.wait()
+                batch = self._pending
+                self._pending = {}
+            finally:
+                self._pendingcond.release()
+            for key, ops in batch.items():
+                try:
+                    self._flushkey(key, ops)
+                except Exception, e:
+                    # _flushkey guards its own persistence work; this
+                    # catches everything outside that (e.g. lock
+                    # acquisition) so one bad batch cannot kill the
+                    # singleton flusher and strand later callers.
+                    self.log.error("Unexpected error flushing %d merge(s) for key %s: %s", len(ops), key, e)
+                    for op in ops:
+                        if op.error is None:
+                            op.error = "Merge failed: %s" % e
+                        op.done.set()
+
+    def _flushkey(self, key, ops):
+        '''
+        Apply a batch of queued merges for one key and wake the callers.
+        '''
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
+        try:
+            try:
+                currentdoc = self.persist.getdocument(key)
+                touched = set()
+                for op in ops:
+                    try:
+                        existingentity = currentdoc[op.entityname]
+                        newentity = op.entitydict[op.entityname]
+                        self.entitymerge(newentity, existingentity)
+                        touched.add(op.entityname)
+                    except KeyError:
+                        op.error = "Attempt to update (PUT) non-existent Entity. Name: %s. " % op.entityname
+                        op.error_status = 405
+                if touched:
+                    if self.persist.supports_patch:
+                        # Push only the entities this batch changed.
+                        for entityname in touched:
+                            self.persist.patch_entity(key, entityname, currentdoc[entityname])
+                    else:
+                        self.persist.storedocument(key, currentdoc)
+                    self._bumpversion(key)
+            except Exception, e:
+                self.log.error("Failed flushing %d merge(s) for key %s: %s", len(ops), key, e)
+                for op in ops:
+                    if op.error is None:
+                        op.error = "Merge failed: %s" % e
         finally:
-            self.persist.lock.release()        
+            rwlock.releaseWrite()
+            for op in ops:
+                op.done.set()
 
     def entitymerge(self, src, dest):
-            ''' 
-            Merges bare src entity into dest entity, unconditionally replacing *attribute* 
-            values at entity-attribute level. Intended to be used in-place, so dest is not returned. 
-            
-            { u'allocations': [u'lincolnb.uchicago-midway']}
-             + 
-            { u'allocations': [], 
-              u'name': u'SPT', 
-              u'blueprints': []  }
-             =
-             {u'allocations': [u'lincolnb.uchicago-midway'],
-             u'name': u'SPT', 
-             u'blueprints': []}
-             
-            '''
-            self.log.debug("Handling merging %s into %s " % (src, dest))
-            for attributename in src.keys():
-                dest[attributename] = src[attributename]
+        '''
+        In-place attribute-level merge; see module-level entitymerge().
+        '''
+        entitymerge(src, dest)
 
     def getentity(self, key, entityname):
         '''
@@ -158,35 +445,58 @@ class InfoHandler(object):
           'key1'  : '<val1>'
         }        
         '''
-        currentdoc = self.persist.getdocument(key)
-        self.log.debug("Current doc for %s is %s" % (key, currentdoc))
+        rwlock = self._lockfor(key)
+        rwlock.acquireRead()
         try:
+            v = self._versions.get(key, 0)
+            gen = self._entity_cache.get(key)
+            if gen is not None and gen[0] == v:
+                je = gen[1].get(entityname)
+                if je is not None:
+                    return je
+            else:
+                gen = None
+            currentdoc = self.persist.getdocument(key)
+            self.log.debug("Current doc for %s is %s", key, currentdoc)
             ed = currentdoc[entityname]
             je = json.dumps(ed)
-            self.log.debug("JSON entity is %s" % str(je))
+            # Start the generation only after the lookup succeeds, so
+            # probes of nonexistent keys do not grow the cache.
+            if gen is None:
+                gen = (v, {})
+                self._entity_cache[key] = gen
+            gen[1][entityname] = je
+            self.log.debug("JSON entity is %s", je)
             return je
         except KeyError:
             cherrypy.response.status = 405
             return "Attempt to GET non-existent Entity. Name: %s. " % entityname
             #raise InfoEntityMissingException("Attempt to update or get a non-existent Entity.")
+        finally:
+            rwlock.releaseRead()
 
 
     def deleteentity(self, key, entityname):
         '''
         deletes relevant entity, if it exists. 
         '''
-        self.persist.lock.acquire()
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
         try:
-            doc = self.persist.getdocument(key)
-            self.log.debug("Deleting entity %s in key %s" % (entityname, key))
-            doc.pop(entityname)
-            self.persist.storedocument(key, doc)
+            self.log.debug("Deleting entity %s in key %s", entityname, key)
+            if self.persist.supports_patch:
+                self.persist.delete_entity(key, entityname)
+            else:
+                doc = self.persist.getdocument(key)
+                doc.pop(entityname)
+                self.persist.storedocument(key, doc)
+            self._bumpversion(key)
             self.log.debug("Successfully stored.")            
         except KeyError:
             cherrypy.response.status = 405
             return "Entity %s not found, so can't delete it." % entityname
         finally:
-            self.persist.lock.release()   
+            rwlock.releaseWrite()
 
 ################################################################################
 #                     Category document-oriented methods
@@ -196,73 +506,89 @@ class InfoHandler(object):
         '''
         Overwrites existing document with new.
         '''
-        self.log.debug("Storing document for key %s" % key)
+        self.log.debug("Storing document for key %s", key)
         pd = json.loads(doc)
-        self.persist.lock.acquire()
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
         try:
             self.persist.storedocument(key, pd)
+            self._bumpversion(key)
         finally:
-            self.persist.lock.release()
+            rwlock.releaseWrite()
     
     def mergedocument(self, key, doc):
-        self.log.debug("Merging document for key %s" % key)
-        self.persist.lock.acquire()
-        try:
-            dcurrent = self.persist.getdocument(key)
-            #pd = json.loads(doc)
-            
-            self.persist.storedocument(key, pd)
-        finally:
-            self.persist.lock.release()
-
-        self.persist.lock.acquire()
+        self.log.debug("Merging document for key %s", key)
+        md = json.loads(doc)
+        self.log.debug("doc to merge is type %s", type(md))
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
         try:
             dcurrent = self.persist.getdocument(key)
-            self.log.debug("current retrieved doc is type %s" % type(dcurrent))
-            md = json.loads(doc)
-            self.log.debug("doc to merge is type %s" % type(md))
+            self.log.debug("current retrieved doc is type %s", type(dcurrent))
             newdoc = self.merge( md, dcurrent)
-            self.log.debug("Merging document for key %s" % key)
             self.persist.storedocument(key, newdoc)
+            self._bumpversion(key)
         finally:
-            self.persist.lock.release()      
+            rwlock.releaseWrite()
 
     def deletedocument(self, key):
-        self.log.debug("Deleting document for key %s" % key)
+        self.log.debug("Deleting document for key %s", key)
         #pd = json.loads(doc)
-        self.persist.lock.acquire()
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
         emptydict = {}
         try:
             self.persist.storedocument(key, emptydict)
+            self._bumpversion(key)
+            # The key is gone; drop its cached serializations outright.
+            self._json_cache.pop(key, None)
+            self._entity_cache.pop(key, None)
         finally:
-            self.persist.lock.release()
+            rwlock.releaseWrite()
 
     def getdocument(self, key):
         '''
         Gets JSON representation of document. 
         '''
-        pd = self.persist.getdocument(key)
-        jd = json.dumps(pd)
-        self.log.debug("d is type %s" % type(jd))
+        rwlock = self._lockfor(key)
+        rwlock.acquireRead()
+        try:
+            v = self._versions.get(key, 0)
+            cached = self._json_cache.get(key)
+            if cached is not None and cached[0] == v:
+                return cached[1]
+            pd = self.persist.getdocument(key)
+            jd = json.dumps(pd)
+            if pd:
+                # Don't pin cache entries for probed-but-nonexistent
+                # keys; the backend answers those with an empty dict.
+                self._json_cache[key] = (v, jd)
+        finally:
+            rwlock.releaseRead()
+        self.log.debug("d is type %s", type(jd))
         return jd
 
 ################################################################################
 #                     Utility methods
 ################################################################################
 
-#    def _getpythondocument(self, key):
-#        '''
-#        Gets Python object. 
-#        '''
-#        d = self.persist.getdocument(key)
-#        self.log.debug("d is type %s with value %s" % (type(d), d))
-#        return d
-    
-#    def _storepythondocument(self, key, pd):
-#        self.log.debug("Storing document for key %s" % key)
-#        self.persist.storedocument(key, pd)
-    
-    
+    def _getpythondocument(self, key):
+        '''
+        Gets Python object. Caller must hold the per-key lock.
+        '''
+        d = self.persist.getdocument(key)
+        self.log.debug("d is type %s with value %s", type(d), d)
+        return d
+
+    def _storepythondocument(self, key, pd):
+        '''
+        Stores Python object. Caller must hold the per-key write lock.
+        '''
+        self.log.debug("Storing document for key %s", key)
+        self.persist.storedocument(key, pd)
+        self._bumpversion(key)
+
+
 #    def deletesubtree(self, path):
 #        lst = path.split('.')
 #        try:
@@ -271,85 +597,60 @@ class InfoHandler(object):
 #            raise Exception('path should have more than one key')
 
     def merge(self, src, dest):
-            ''' 
-            Merges python primitive object src into dest and returns merged result.
-            Lists are appended.
-            Dictionaries are merged. 
-            Primitive values are overwritten. 
-            NOTE: tuples and arbitrary objects are not handled as it is totally ambiguous what should happen
-            https://stackoverflow.com/questions/7204805/dictionaries-of-dictionaries-merge/15836901
-            '''
-            key = None
-            # ## debug output
-            # sys.stderr.write("DEBUG: %s to %s\n" %(b,a))
-            self.log.debug("Handling merging %s into %s " % (src, dest))
-            try:
-                if dest is None or isinstance(dest, str) or isinstance(dest, unicode) or isinstance(dest, int) \
-                             or isinstance(dest, long) or isinstance(dest, float):
-                    # border case for first run or if a is a primitive
-                    dest = src
-                elif isinstance(dest, list):
-                    # lists can be only appended
-                    if isinstance(src, list):
-                        # merge lists
-                        for item in src:
-                            if item not in dest:
-                                dest.append(item)
-                        #dest.extend(src)
-                    else:
-                        self.log.error("Refusing to add non-list %s to list %s" % (src, dest))
-                        # append to list
-                        #dest.append(src)
-                elif isinstance(dest, dict):
-                    # dicts must be merged
-                    if isinstance(src, dict):
-                        for key in src:
-                            if key in dest:
-                                dest[key] = self.merge(src[key], dest[key])
-                            else:
-                                dest[key] = src[key]
-                    elif src is None:
-                        dest = None
-                    else:
-                        self.log.warning("Cannot merge non-dict %s into dict %s" % (src, dest))
-                else:
-                    raise Exception('NOT IMPLEMENTED "%s" into "%s"' % (src, dest))
-            except TypeError, e:
-                raise Exception('TypeError "%s" in key "%s" when merging "%s" into "%s"' % (e, key, src, dest))
-            return dest
-
+        '''
+        Merges src into dest and returns the result; see module-level merge().
+        '''
+        return merge(src, dest)
 
 ##################################################################################
 #                             Infrastructural methods 
 ##################################################################################
     
+    def _paircodeindexfor(self, key, pd):
+        '''
+        Return the {pairingcode : entryname} index for the pairing doc,
+        rebuilding it only when the key's version has moved on. Caller
+        must hold the per-key lock.
+        '''
+        v = self._versions.get(key, 0)
+        cached = self._paircodeindex.get(key)
+        if cached is not None and cached[0] == v:
+            return cached[1]
+        index = {}
+        for p in pd[key].keys():
+            index[pd[key][p]['pairingcode']] = p
+        self._paircodeindex[key] = (v, index)
+        return index
+
     def getpairing(self, key, pairingcode):
         '''
-        Pull pairing document, check each entry to see if <entry>.pairingcode = pairingcode.
-        If so, and cert and key are not none, prepare to return them, delete entry, return Pairing
+        Pull pairing document and look up the entry with the requested
+        pairingcode via the sidecar index.
+        If found, and cert and key are not none, prepare to return them, delete entry, return Pairing
         '''
         failmsg="Invalid pairing code or not satisfied yet. Try in 30 seconds."
         prd = None
-        pd = self._getpythondocument(key)
-        self.log.debug("Received dict: %s" % pd)
-        try:        
-            self.log.debug("Entries are %s" % pd[key] )
-            for p in pd[key].keys():
-                self.log.debug("Checking entry %s for pairingcode..." % p)
-                if pd[key][p]['pairingcode'] == pairingcode:
-                    self.log.debug("Found matching entry %s value %s" % (p, pd[key][p]))
-                    if pd[key][p]['cert'] is not None:
-                        prd = json.dumps(pd[key][p])
-                        try:
-                            self.log.debug("Attempting to delete entry %s from pairing." % p)
-                            pd[key].pop(p, None)
-                            self.log.debug("Deleted entry %s from pairing. Re-storing.." % p)
-                        except KeyError:
-                            self.log.warning("Failed to delete entry %s from pairing." % p)
-                        self._storepythondocument(key, pd)
-                    else:
-                        self.log.info("Certificate for requested pairing not generated yet.")
-            self.log.debug("Returning pairing entry JSON %s" % prd)
+        rwlock = self._lockfor(key)
+        rwlock.acquireWrite()
+        try:
+            pd = self._getpythondocument(key)
+            self.log.debug("Received dict: %s", pd)
+            self.log.debug("Entries are %s", pd[key])
+            p = self._paircodeindexfor(key, pd).get(pairingcode)
+            if p is not None and p in pd[key]:
+                self.log.debug("Found matching entry %s value %s", p, pd[key][p])
+                if pd[key][p]['cert'] is not None:
+                    prd = json.dumps(pd[key][p])
+                    try:
+                        self.log.debug("Attempting to delete entry %s from pairing.", p)
+                        pd[key].pop(p, None)
+                        self.log.debug("Deleted entry %s from pairing. Re-storing..", p)
+                    except KeyError:
+                        self.log.warning("Failed to delete entry %s from pairing.", p)
+                    self._storepythondocument(key, pd)
+                else:
+                    self.log.info("Certificate for requested pairing not generated yet.")
+            self.log.debug("Returning pairing entry JSON %s", prd)
             if prd is None:
                 cherrypy.response.headers["Status"] = "404"
                 return failmsg
@@ -357,6 +658,8 @@ class InfoHandler(object):
         except KeyError:
             cherrypy.response.headers["Status"] = "404"
             return failmsg
+        finally:
+            rwlock.releaseWrite()
 
     def getCAChain(self):
         '''
@@ -373,46 +676,91 @@ class InfoRoot(object):
 
     @cherrypy.expose
     def generate(self, length=8):
-        return ''.join(random.sample(string.hexdigits, int(length)))
+        # os.urandom is a CSPRNG suitable for pairing codes; the old
+        # random.sample(string.hexdigits, n) was predictable and broke
+        # for n > 22 (hexdigits only has 22 characters).
+        length = int(length)
+        return os.urandom((length + 1) // 2).encode('hex')[:length]
+
+# Whole-document responses at/above this size are streamed in slices
+# instead of being buffered by cherrypy in one piece.
+_STREAM_THRESHOLD = 1024 * 1024
+_STREAM_CHUNK = 64 * 1024
+
+def _iterchunks(body):
+    '''
+    Yield <body> in _STREAM_CHUNK-sized slices for a streaming response.
+    '''
+    for i in xrange(0, len(body), _STREAM_CHUNK):
+        yield body[i:i + _STREAM_CHUNK]
+
 
 class InfoServiceAPI(object):
-    ''' 
-        Data at this level is assumed to be  JSON text/plain. 
-    
+    '''
+        Data at this level is assumed to be  JSON text/plain.
+
     '''
     exposed = True 
     
-    def __init__(self, config):
-        self.log = logging.getLogger()
+    def __init__(self, config, infohandler=None):
+        self.log = log
         self.log.debug("Initting InfoServiceAPI...")
-        self.infohandler = InfoHandler(config)
+        if infohandler is None:
+            infohandler = InfoHandler(config)
+        self.infohandler = infohandler
         self.log.debug("InfoServiceAPI init done." )
     
     def GET(self, key, pairingcode=None, entityname=None):
         if pairingcode is None and entityname is None:
-            d = self.infohandler.getdocument(key) 
-            self.log.debug("Document retrieved for key %s " % key)
+            if self._notmodified(key):
+                return ''
+            d = self.infohandler.getdocument(key)
+            self.log.debug("Document retrieved for key %s ", key)
+            if len(d) >= _STREAM_THRESHOLD:
+                # Big document: stream slices of the cached JSON string so
+                # cherrypy starts writing immediately and never holds a
+                # second full copy of the body.
+                cherrypy.response.stream = True
+                return _iterchunks(d)
             return d
         elif pairingcode is None:
-            e = self.infohandler.getentity(key, entityname) 
-            self.log.debug("Entity retrieved for key %s and name %s" % (key,entityname))
+            if self._notmodified(key, entityname):
+                return ''
+            e = self.infohandler.getentity(key, entityname)
+            self.log.debug("Entity retrieved for key %s and name %s", key,entityname)
             return e
         else:
             self.log.debug("Handling pairing retrieval")
             d = self.infohandler.getpairing(key, pairingcode)
-            self.log.debug("Pairing retrieved for code %s with val %s" % (pairingcode,d))
+            self.log.debug("Pairing retrieved for code %s with val %s", pairingcode,d)
             return d
 
+    def _notmodified(self, key, entityname=None):
+        '''
+        Set an ETag from the per-key document version and answer True if
+        the client's If-None-Match already has it, so polling clients
+        skip re-serialization and payload bytes for unchanged documents.
+        '''
+        if entityname is None:
+            etag = '"%s/%s/%d"' % (self.infohandler.etagepoch, key, self.infohandler.getversion(key))
+        else:
+            etag = '"%s/%s/%s/%d"' % (self.infohandler.etagepoch, key, entityname, self.infohandler.getversion(key))
+        cherrypy.response.headers['ETag'] = etag
+        if cherrypy.request.headers.get('If-None-Match') == etag:
+            cherrypy.response.status = 304
+            return True
+        return False
+
     @cherrypy.tools.accept(media='text/plain')
     def PUT(self, key, entityname=None, data=None):
         rtext = "Something went wrong..."
         if entityname is None:
-            self.log.debug("Storing document %s" % data)
+            self.log.debug("Storing document %s", data)
             self.infohandler.mergedocument(key, data)
-            self.log.debug("Document stored for key %s" % key)
+            self.log.debug("Document stored for key %s", key)
             rtext= "Document stored for key %s\n" % key
         else:
-            self.log.debug("Storing key %s entityname %s " % (key, entityname))
+            self.log.debug("Storing key %s entityname %s ", key, entityname)
             self.infohandler.mergeentity(key, entityname, data)
             rtext= "Entity %s stored in key %s\n" % (entityname, key )
         return rtext
@@ -421,12 +769,12 @@ class InfoServiceAPI(object):
     def POST(self, key, entityname=None, data=None):
         rtext = "Something went wrong..."
         if entityname is None:
-            self.log.debug("Storing document %s" % data)
+            self.log.debug("Storing document %s", data)
             self.infohandler.storedocument(key, data)
-            self.log.debug("Document stored for key %s" % key)
+            self.log.debug("Document stored for key %s", key)
             rtext= "Document stored for key %s\n" % key
         else:
-            self.log.debug("Storing key %s entityname %s " % (key, entityname))
+            self.log.debug("Storing key %s entityname %s ", key, entityname)
             self.infohandler.storeentity(key, entityname, data)
             rtext= "Entity %s stored in key %s\n" % (entityname, key )
         return rtext
@@ -445,30 +793,68 @@ class InfoServiceAPI(object):
         return rs
 
 
+class InfoServiceROAPI(object):
+    '''
+    Read-only facade over an InfoServiceAPI, mounted at /info/ro.
+    Only GET is defined, so the MethodDispatcher answers 405 to any
+    mutating verb: clients pointed here can never change state, even by
+    misconfiguration. This is routing-level enforcement only — both
+    mounts share the single CherryPy worker pool, and read concurrency
+    comes from the handler's per-key readers-writer locks, not from
+    this mount.
+    '''
+    exposed = True
+
+    def __init__(self, api):
+        self.log = log
+        self.api = api
+
+    def GET(self, key, pairingcode=None, entityname=None):
+        return self.api.GET(key, pairingcode, entityname)
+
+
 class InfoService(object):
     
     def __init__(self, config):
-        self.log = logging.getLogger()
+        self.log = log
         self.log.debug('InfoService class init...')
         self.config = config
-        self.certfile = os.path.expanduser(config.get('netcomm','certfile'))
-        self.keyfile = os.path.expanduser(config.get('netcomm', 'keyfile'))
-        self.chainfile = os.path.expanduser(config.get('netcomm','chainfile'))
-        self.httpport = int(config.get('netcomm','httpport'))
-        self.httpsport = int(config.get('netcomm','httpsport'))
-        self.sslmodule = config.get('netcomm','sslmodule')
-        
-        self.log.debug("certfile=%s" % self.certfile)
-        self.log.debug("keyfile=%s" % self.keyfile)
-        self.log.debug("chainfile=%s" % self.chainfile)
+        self.cfg = _snapshot(config)
+        netcomm = self.cfg['netcomm']
+        self.certfile = os.path.expanduser(netcomm['certfile'])
+        self.keyfile = os.path.expanduser(netcomm['keyfile'])
+        self.chainfile = os.path.expanduser(netcomm['chainfile'])
+        self.httpport = int(netcomm['httpport'])
+        self.httpsport = int(netcomm['httpsport'])
+        self.sslmodule = netcomm['sslmodule']
+        # One handler shared by all mounts, so the per-key locks, version
+        # counters and JSON caches have a single authoritative copy.
+        self.infohandler = InfoHandler(config)
+
+        self.log.debug("certfile=%s", self.certfile)
+        self.log.debug("keyfile=%s", self.keyfile)
+        self.log.debug("chainfile=%s", self.chainfile)
         
         self.log.debug('InfoService class done.')
         
     def run(self):
         self.log.debug('Infoservice running...')
-          
+
+        # JSON payloads compress well and documents can be sizable, so
+        # gzip responses; a deeper accept queue absorbs poll bursts.
+        cherrypy.config.update({'tools.gzip.on'         : True,
+                                'tools.gzip.mime_types' : ['application/json', 'text/plain'],
+                                'response.stream'       : False,
+                                })
+
         cherrypy.tree.mount(InfoRoot())
-        cherrypy.tree.mount(InfoServiceAPI(self.config),'/info',
+        api = InfoServiceAPI(self.config, self.infohandler)
+        cherrypy.tree.mount(api,'/info',
+                                {'/':
+        {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}
+    })
+        # GET-only mount over the same handler, for read-only clients.
+        cherrypy.tree.mount(InfoServiceROAPI(api),'/info/ro',
                                 {'/':
         {'request.dispatch': cherrypy.dispatch.MethodDispatcher()}
     })
@@ -477,10 +863,18 @@ class InfoService(object):
         
         cherrypy.server.unsubscribe()
     
+        try:
+            ncpu = multiprocessing.cpu_count()
+        except NotImplementedError:
+            ncpu = 1
+
         server1 = cherrypy._cpserver.Server()
         server1.socket_port=self.httpsport
         server1._socket_host='0.0.0.0'
-        server1.thread_pool=30
+        server1.thread_pool = max(30, 4 * ncpu)
+        server1.socket_queue_size = 128
+        server1.socket_timeout = 30
+        server1.protocol_version = 'HTTP/1.1'
         server1.ssl_module = self.sslmodule
         server1.ssl_certificate = self.certfile
         server1.ssl_private_key = self.keyfile
@@ -497,6 +891,45 @@ class InfoService(object):
         cherrypy.engine.block()   
     
 
+# Resolved passwd entries by username. NSS lookups can touch /etc/passwd
+# or a remote directory service, so each account is resolved once per
+# process and reused across the startup path.
+_PW_CACHE = {}
+
+def _resolve_user(name):
+    '''
+    pwd.getpwnam, memoized per username. Raises KeyError for unknown
+    accounts, same as the underlying call.
+    '''
+    try:
+        return _PW_CACHE[name]
+    except KeyError:
+        pw = _PW_CACHE[name] = pwd.getpwnam(name)
+        return pw
+
+
+# The most recently parsed configuration, keyed by the confFiles list
+# and the mtimes of its files, so a repeat __createconfig (e.g. a future
+# SIGHUP reload handler) skips re-tokenizing unchanged configuration.
+# At most one entry: each config edit produces a new key, and keeping
+# history would retain a full ConfigParser per past mtime combination.
+_CONFIG_CACHE = {}
+
+def _configcachekey(paths):
+    '''
+    Cache key for a confFiles list: each path with its current mtime.
+    Missing paths key as None, so a file appearing or changing
+    invalidates the entry.
+    '''
+    key = []
+    for path in paths:
+        try:
+            key.append((path, os.stat(path).st_mtime))
+        except OSError:
+            key.append((path, None))
+    return tuple(key)
+
+
 class InfoServiceCLI(object):
     """class to handle the command line invocation of service. 
        parse the input options,
@@ -607,9 +1040,8 @@ John Hover <jhover@bnl.gov>
             logdir = os.path.dirname(lf)
             if not os.path.exists(logdir):
                 os.makedirs(logdir)
-            runuid = pwd.getpwnam(self.options.runAs).pw_uid
-            rungid = pwd.getpwnam(self.options.runAs).pw_gid                  
-            os.chown(logdir, runuid, rungid)
+            runas_pw = _resolve_user(self.options.runAs)
+            os.chown(logdir, runas_pw.pw_uid, runas_pw.pw_gid)
             #logStream = logging.FileHandler(filename=lf)
             logStream = logging.handlers.RotatingFileHandler(filename=lf, maxBytes=1024 * 1024 * self.options.maxlogsize, backupCount=self.options.logrotations)
 
@@ -633,25 +1065,28 @@ John Hover <jhover@bnl.gov>
                 console.setLevel(self.options.logLevel)
                 self.log.addHandler(console)
         self.log.setLevel(self.options.logLevel)
-        self.log.info('Logging initialized at level %s.' % self.options.logLevel)
+        self.log.info('Logging initialized at level %s.', self.options.logLevel)
 
 
     def _printenv(self):
-
-        envmsg = ''        
-        for k in sorted(os.environ.keys()):
-            envmsg += '\n%s=%s' %(k, os.environ[k])
-        self.log.debug('Environment : %s' %envmsg)
+        '''
+        Dump the environment as one DEBUG record; a no-op (no string
+        building at all) at higher log levels.
+        '''
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return
+        envmsg = '\n'.join('%s=%s' % (k, os.environ[k]) for k in sorted(os.environ))
+        self.log.debug('Environment :\n%s', envmsg)
 
 
     def __platforminfo(self):
         '''
-        display basic info about the platform, for debugging purposes 
+        display basic info about the platform, for debugging purposes
         '''
-        self.log.info('platform: uname = %s %s %s %s %s %s' %platform.uname())
-        self.log.info('platform: platform = %s' %platform.platform())
-        self.log.info('platform: python version = %s' %platform.python_version())
-        self._printenv()
+        self.log.info('platform: uname = %s %s %s %s %s %s ; platform = %s ; python version = %s',
+                      *(platform.uname() + (platform.platform(), platform.python_version())))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self._printenv()
 
     def __checkroot(self): 
         """
@@ -661,67 +1096,105 @@ John Hover <jhover@bnl.gov>
         starting_gid = os.getgid()
         starting_uid_name = pwd.getpwuid(starting_uid)[0]
 
-        hostname = socket.gethostname()
-        
-        if os.getuid() != 0:
-            self.log.info("Already running as unprivileged user %s at %s" % (starting_uid_name, hostname))
-            
-        if os.getuid() == 0:
+        # Resolve the runAs account once and reuse the passwd struct for
+        # uid, gid and home below, rather than hitting NSS per field.
+        try:
+            self._runas_pw = _resolve_user(self.options.runAs)
+        except KeyError, e:
+            self.log.error('No such user %s, unable run properly. Error: %s', self.options.runAs, e)
+            sys.exit(1)
+
+        hostname = _HOSTNAME
+
+        if starting_uid != 0:
+            self.log.info("Already running as unprivileged user %s at %s", starting_uid_name, hostname)
+        else:
             try:
-                runuid = pwd.getpwnam(self.options.runAs).pw_uid
-                rungid = pwd.getpwnam(self.options.runAs).pw_gid
-                os.chown(self.options.logfile, runuid, rungid)
+                runuid = self._runas_pw.pw_uid
+                rungid = self._runas_pw.pw_gid
+                try:
+                    st = os.stat(self.options.logfile)
+                    if st.st_uid != runuid or st.st_gid != rungid:
+                        # Only dirty the inode when ownership actually
+                        # changed; after the first run it already matches.
+                        os.chown(self.options.logfile, runuid, rungid)
+                except OSError:
+                    # No such file: logging goes to stdout/syslog, or the
+                    # logfile has not been created yet. Nothing to chown.
+                    pass
                 
+                # setuid to a non-root uid also sets the effective uid, so
+                # the old seteuid/setegid calls after it were redundant
+                # (and the setegid ran unprivileged anyway). gid first,
+                # while we still have the privilege to change it.
                 os.setgid(rungid)
                 os.setuid(runuid)
-                os.seteuid(runuid)
-                os.setegid(rungid)
 
-                self._changehome()
-                self._changewd()
+                self._apply_runas_env(self._runas_pw)
 
-                self.log.info("Now running as user %d:%d at %s..." % (runuid, rungid, hostname))
-                self._printenv()
+                self.log.info("Now running as user %d:%d at %s...", runuid, rungid, hostname)
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self._printenv()
 
             
             except KeyError, e:
-                self.log.error('No such user %s, unable run properly. Error: %s' % (self.options.runAs, e))
+                self.log.error('No such user %s, unable run properly. Error: %s', self.options.runAs, e)
                 sys.exit(1)
                 
             except OSError, e:
-                self.log.error('Could not set user or group id to %s:%s. Error: %s' % (runuid, rungid, e))
+                self.log.error('Could not set user or group id to %s:%s. Error: %s', runuid, rungid, e)
                 sys.exit(1)
 
-    def _changehome(self):
-        '''
-        Set environment HOME to user HOME.
-        '''
-        runAs_home = pwd.getpwnam(self.options.runAs).pw_dir 
-        os.environ['HOME'] = runAs_home
-        self.log.debug('Setting up environment variable HOME to %s' %runAs_home)
-
-
-    def _changewd(self):
+    def _apply_runas_env(self, pw):
         '''
-        changing working directory to the HOME directory of the new user,
+        Point HOME and the working directory at the home directory of
+        the already-resolved runAs account.
         '''
-        runAs_home = pwd.getpwnam(self.options.runAs).pw_dir
-        os.chdir(runAs_home)
-        self.log.debug('Switching working directory to %s' %runAs_home)
+        # HOME must be correct for the runAs account: os.path.expanduser
+        # resolves certfile/keyfile/logfile config paths through it. But
+        # os.environ assignment does a C-level putenv, so skip it when
+        # the value is already right.
+        if os.environ.get('HOME') != pw.pw_dir:
+            os.environ['HOME'] = pw.pw_dir
+        os.chdir(pw.pw_dir)
+        self.log.debug('Set HOME and working directory to %s', pw.pw_dir)
 
 
     def __createconfig(self):
         """Create config, add in options...
         """
-        if self.options.confFiles != None:
+        if not self.options.confFiles:
+            return
+        self.log.debug("Conf file list %s", self.options.confFiles)
+        cachekey = _configcachekey(self.options.confFiles)
+        cached = _CONFIG_CACHE.get(cachekey)
+        if cached is not None:
+            self.log.debug("Config files unchanged, reusing parsed config.")
+            self.config = cached
+            return
+        # The default confFiles list includes locations that exist only
+        # in some deployments, so absence is a warning, not an error.
+        # Anything else (unreadable file, parse error) propagates with
+        # its real message rather than a generic 'Config failure'.
+        missing = [p for p in self.options.confFiles if not os.path.exists(p)]
+        if missing:
+            self.log.warning("Config file(s) not found, skipping: %s", missing)
+        self.config = ConfigParser()
+        rfs = []
+        for path in self.options.confFiles:
+            if path in missing:
+                continue
+            # Open each file explicitly with a buffered reader rather
+            # than ConfigParser.read(), which silently skips missing paths.
+            fileobj = io.open(path, 'r', buffering=65536)
             try:
-                self.log.debug("Conf file list %s" % self.options.confFiles)
-                self.config = ConfigParser()
-                rfs = self.config.read(self.options.confFiles)
-                self.log.debug("Read config file(s) %s" % rfs)
-            except Exception, e:
-                self.log.error('Config failure')
-                sys.exit(1)
+                self.config.readfp(fileobj)
+            finally:
+                fileobj.close()
+            rfs.append(path)
+        self.log.debug("Read config file(s) %s", rfs)
+        _CONFIG_CACHE.clear()
+        _CONFIG_CACHE[cachekey] = self.config
         
         #self.config.set("global", "configfiles", self.options.confFiles)
            
@@ -737,17 +1210,16 @@ John Hover <jhover@bnl.gov>
             
         except KeyboardInterrupt:
             self.log.info('Caught keyboard interrupt - exitting')
-            f.join()
             sys.exit(0)
         except ImportError, errorMsg:
-            self.log.error('Failed to import necessary python module: %s' % errorMsg)
+            self.log.error('Failed to import necessary python module: %s', errorMsg)
+            sys.exit(1)
+        except Exception:
+            # Format the traceback once and reuse it for both sinks.
+            tb = traceback.format_exc()
+            self.log.error('Unexpected exception!\n%s', tb)
+            sys.stderr.write(tb)
             sys.exit(1)
-        except:
-            self.log.error('''Unexpected exception!''')
-            # The following line prints the exception to the logging module
-            self.log.error(traceback.format_exc(None))
-            print(traceback.format_exc(None))
-            sys.exit(1)          
 
 if __name__ == '__main__':
     iscli = InfoServiceCLI()
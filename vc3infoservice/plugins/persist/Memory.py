@@ -4,8 +4,15 @@ from vc3infoservice.core import InfoPersistencePlugin
 
 class Memory(InfoPersistencePlugin):
     '''
-    Memory persistence plugin. Takes inbound Python primitive documents and simply keeps them in memory. 
+    Memory persistence plugin. Takes inbound Python primitive documents and simply keeps them in memory.
     '''
+    # Documents live in a plain dict, so single-entity writes need no
+    # whole-document round trip.
+    supports_patch = True
+    # A store touches only documents[key]; nothing is shared across
+    # keys, so concurrent writers of different keys are safe.
+    supports_keyed_writes = True
+
     def __init__(self, parent, config, section ):
         super(Memory, self).__init__(parent, config, section)
         self.lock = threading.Lock()
@@ -24,6 +31,26 @@ class Memory(InfoPersistencePlugin):
             s = {}
         return s
 
+    def patch_entity(self, key, entityname, entitydict):
+        '''
+        Create or update a single entity without rewriting the document.
+        Existing entities get attribute-level replacement, matching
+        entitymerge() semantics.
+        '''
+        self.log.debug("Patching entity %s in key %s..." % (entityname, key))
+        doc = self.documents.setdefault(key, {})
+        try:
+            doc[entityname].update(entitydict)
+        except KeyError:
+            doc[entityname] = entitydict
+
+    def delete_entity(self, key, entityname):
+        '''
+        Remove a single entity. Raises KeyError if key or entity is absent.
+        '''
+        self.log.debug("Deleting entity %s in key %s..." % (entityname, key))
+        del self.documents[key][entityname]
+
     def _deletesubtree(self, path):
         self.log.debug("Deleting path %s..." % str(path))
 